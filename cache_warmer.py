@@ -0,0 +1,204 @@
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+from logger import setup_logger
+from load import iter_local_physicians, is_metro_msa, NON_METRO_CODE
+from group_physicians import get_groups
+from plot_physician_groups import extract_record
+
+logger = setup_logger('cache_warmer_logger', 'cache_warmer.log')
+
+STATS_DB = '.\\Datas\\search_stats.db'
+TOP_N = 5
+RECORD_LIMIT = 20  # same number of records as a live search
+WARM_INTERVAL = 3600  # seconds between refreshes of the hot set
+JOB_PAUSE = 5  # seconds to yield between two warm-up jobs
+CALL_PAUSE = 2  # seconds between two LLM queries or geocodes of a warm-up job
+MAX_WORKERS = 1
+
+_lock = threading.Lock()
+_results = {}
+_live_searches = 0
+_idle = threading.Condition(_lock)
+
+
+def _connect():
+    """
+    Open the search statistics database, creating the table if needed.
+    """
+    conn = sqlite3.connect(STATS_DB)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS search_counts (MSA TEXT PRIMARY KEY, Count INTEGER, LastSearched TEXT)")
+    return conn
+
+
+def record_search(msa_code):
+    """
+    Count a search for the MSA code so the hot set follows what users look
+    for. Non-metro and invalid codes are not counted.
+    """
+    if not is_metro_msa(msa_code):
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO search_counts VALUES (?, 1, ?) "
+                "ON CONFLICT(MSA) DO UPDATE SET Count = Count + 1, LastSearched = excluded.LastSearched",
+                (str(int(msa_code)), datetime.now().isoformat()))
+    finally:
+        conn.close()
+
+
+def get_hot_msas(top_n=TOP_N):
+    """
+    Get the codes of the top-N most searched MSAs, filled up with the most
+    populous MSAs (by number of ZIP codes) while there is not enough search
+    history.
+    """
+    conn = _connect()
+    try:
+        searched = pd.read_sql_query(
+            "SELECT MSA FROM search_counts ORDER BY Count DESC LIMIT ?", conn, params=(top_n,))
+    finally:
+        conn.close()
+    msas = [msa for msa in searched['MSA'].tolist() if is_metro_msa(msa)]
+    if len(msas) < top_n:
+        conn = sqlite3.connect('.\\Datas\\msatozip.db')
+        populous = pd.read_sql_query(
+            "SELECT MSA FROM data_table WHERE MSA > 0 AND MSA < ? "
+            "GROUP BY MSA ORDER BY COUNT(ZIP) DESC LIMIT ?", conn, params=(NON_METRO_CODE, top_n))
+        conn.close()
+        for msa in populous['MSA'].astype(str).tolist():
+            if len(msas) >= top_n:
+                break
+            if msa not in msas:
+                msas.append(msa)
+    return msas
+
+
+def _throttle():
+    """
+    Hold a warm-up job back while a live search runs, and pace its calls
+    so it never competes with live searches for the LLM and geocoder.
+    """
+    _wait_for_idle()
+    time.sleep(CALL_PAUSE)
+
+
+def compute_search_results(msa):
+    """
+    Compute the full search results for an MSA with the regular search
+    functions, yielding to live searches between NPI fetches, LLM queries
+    and geocodes. Like a live search, only the ZIP codes needed for the
+    first RECORD_LIMIT records are loaded.
+
+    Returns:
+        tuple: (person_groups, data) as shown by the UI.
+    """
+    json_data = []
+    for batch in iter_local_physicians(msa, before_fetch=_throttle):
+        json_data.extend(batch[:RECORD_LIMIT - len(json_data)])
+        if len(json_data) >= RECORD_LIMIT:
+            break
+    person_groups, data_lst = get_groups(json_data, before_query=_throttle)
+    records = []
+    for record in data_lst[:RECORD_LIMIT]:
+        _throttle()
+        row = extract_record(record)
+        if row:
+            records.append(row)
+    return person_groups, pd.DataFrame(records)
+
+
+def get_warm_results(msa_code):
+    """
+    Get the precomputed search results for an MSA code, or None if it is not
+    warm.
+    """
+    with _lock:
+        entry = _results.get(str(msa_code))
+    return entry[1] if entry else None
+
+
+@contextmanager
+def live_search():
+    """
+    Mark a live search as running so the warmer holds back until it is done.
+    """
+    global _live_searches
+    with _lock:
+        _live_searches += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _live_searches -= 1
+            _idle.notify_all()
+
+
+def _wait_for_idle():
+    """
+    Block until no live search is running.
+    """
+    with _lock:
+        _idle.wait_for(lambda: _live_searches == 0)
+
+
+def warm_msa(msa):
+    """
+    Precompute and store the search results for an MSA.
+    """
+    tt = time.time()
+    try:
+        results = compute_search_results(msa)
+    except Exception as e:
+        logger.error(f"Error warming {msa}: {e}")
+        print(f"Error warming {msa}: {e}")
+        return
+    with _lock:
+        _results[str(msa)] = (time.time(), results)
+    logger.info(f"Warmed {msa} in {time.time() - tt:.1f}s")
+    print(f"Warmed {msa} in {time.time() - tt:.1f}s")
+
+
+def _warm_loop(top_n, interval, max_workers):
+    """
+    Keep the hot set warm, one bounded batch of jobs at a time.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            try:
+                hot = get_hot_msas(top_n)
+            except Exception as e:
+                logger.error(f"Error reading hot MSAs: {e}")
+                hot = []
+            now = time.time()
+            with _lock:
+                stale = [msa for msa in hot
+                         if str(msa) not in _results or now - _results[str(msa)][0] > interval]
+            logger.info(f"Warming {len(stale)} of {len(hot)} hot MSAs")
+            for start in range(0, len(stale), max_workers):
+                _wait_for_idle()
+                jobs = [executor.submit(warm_msa, msa)
+                        for msa in stale[start:start + max_workers]]
+                concurrent.futures.wait(jobs)
+                time.sleep(JOB_PAUSE)
+            time.sleep(interval)
+
+
+@st.cache_resource
+def start_cache_warmer(top_n=TOP_N, interval=WARM_INTERVAL, max_workers=MAX_WORKERS):
+    """
+    Start the background cache warmer once per process.
+    """
+    thread = threading.Thread(target=_warm_loop, args=(
+        top_n, interval, max_workers), daemon=True, name="cache-warmer")
+    thread.start()
+    logger.info(f"Started cache warmer for the top {top_n} MSAs")
+    return thread
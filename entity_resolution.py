@@ -0,0 +1,157 @@
+import re
+from rapidfuzz import fuzz
+from logger import setup_logger
+
+logger = setup_logger('entity_resolution_logger', 'entity_resolution.log')
+
+NAME_PREFIXES = {"DR", "MR", "MRS", "MS", "MISS", "PROF"}
+NAME_SUFFIXES = {"JR", "SR", "II", "III", "IV", "V"}
+CREDENTIALS = {"MD", "DO", "DDS", "DMD", "DPM", "DC", "OD", "PHD", "PSYD",
+               "PHARMD", "RN", "NP", "APRN", "CRNA", "PA", "PAC", "PT", "DPT",
+               "OT", "OTR", "OTRL", "LCSW", "LICSW", "LMHC", "MSW", "MPH",
+               "MBA", "FACP", "FACS", "CNM", "CNP", "FNP", "AUD", "CCCSLP"}
+FIRST_NAME_SIMILARITY = 95
+MIN_FUZZY_LENGTH = 5
+
+
+def _clean_token(token: str) -> str:
+    """
+    Remove everything but letters, apostrophes and hyphens from a token.
+    """
+    return re.sub(r"[^A-Z'-]", "", token).strip("'-")
+
+
+def _is_title(token: str) -> bool:
+    """
+    Check whether a token is a name suffix or a credential.
+    """
+    return token.replace("-", "") in NAME_SUFFIXES | CREDENTIALS
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a name by upper-casing it and removing punctuation, leading
+    prefixes, trailing suffixes and credentials, e.g.
+    'Carlos A Fontanez, M.D.' -> 'CARLOS A FONTANEZ'.
+
+    Credentials are only removed after a comma or when written with dots
+    (e.g. 'M.D.'), so surnames like 'DO' in 'TUAN ANH DO' are kept. At the
+    end of the name only generational suffixes are removed, and never when
+    only a first and last name would remain, so 'JOHN V SMITH' is kept too.
+    """
+    parts = str(name).upper().split(",")
+    tokens = []
+    for raw in parts[0].split():
+        token = _clean_token(raw)
+        if token and not ("." in raw and token.replace("-", "") in CREDENTIALS):
+            tokens.append(token)
+    for part in parts[1:]:
+        tokens.extend(t for t in (_clean_token(t) for t in part.split())
+                      if t and not _is_title(t))
+    while len(tokens) > 2 and tokens[0].replace("-", "") in NAME_PREFIXES:
+        tokens.pop(0)
+    while len(tokens) > 2 and tokens[-1].replace("-", "") in NAME_SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def blocking_key(normalized: str, postal_code: str) -> tuple:
+    """
+    Get the block a name is compared within: its surname and 5-digit ZIP code.
+    """
+    tokens = normalized.split()
+    surname = tokens[-1] if tokens else ""
+    return surname, str(postal_code or "")[:5]
+
+
+def _compatible(a: str, b: str) -> bool:
+    """
+    Check whether two name parts agree, treating an initial as a match for
+    any name starting with it.
+    """
+    if len(a) == 1 or len(b) == 1:
+        return a[0] == b[0]
+    return a == b
+
+
+def _same_first_name(a: str, b: str) -> bool:
+    """
+    Check whether two first names agree, allowing a typo in long names.
+    """
+    if _compatible(a, b):
+        return True
+    if min(len(a), len(b)) < MIN_FUZZY_LENGTH:
+        return False
+    return fuzz.ratio(a, b) >= FIRST_NAME_SIMILARITY
+
+
+def _same_middle_names(a: list, b: list) -> bool:
+    """
+    Check whether two lists of middle names agree. A missing middle name is
+    unknown and matches anything, but conflicting ones never match.
+    """
+    return all(_compatible(x, y) for x, y in zip(a, b))
+
+
+def is_same_person(a: str, b: str) -> bool:
+    """
+    Decide whether two normalized names in the same block refer to the same
+    person.
+    """
+    if a == b:
+        return True
+    a_tokens, b_tokens = a.split(), b.split()
+    if len(a_tokens) < 2 or len(b_tokens) < 2:
+        return False
+    return (_same_first_name(a_tokens[0], b_tokens[0])
+            and _same_middle_names(a_tokens[1:-1], b_tokens[1:-1]))
+
+
+def add_name(blocks: dict, name: str, postal_code: str = ""):
+    """
+    Add a name to the blocks, merging it into an existing person if it
+    matches one.
+
+    Args:
+        blocks (dict): Blocking key -> list of person clusters, updated in place.
+        name (str): The raw name.
+        postal_code (str): ZIP code the name was found at.
+
+    Returns:
+        tuple: (cluster, is_new) where cluster has the canonical 'name', its
+               normalized 'key' and all raw 'variants'.
+    """
+    normalized = normalize_name(name)
+    clusters = blocks.setdefault(blocking_key(normalized, postal_code), [])
+    for cluster in clusters:
+        if is_same_person(cluster["key"], normalized):
+            if name not in cluster["variants"]:
+                cluster["variants"].append(name)
+            # Keep the most complete variant as the canonical name.
+            if len(normalized) > len(cluster["key"]):
+                cluster["name"], cluster["key"] = name, normalized
+            return cluster, False
+    cluster = {"name": name, "key": normalized, "variants": [name]}
+    clusters.append(cluster)
+    return cluster, True
+
+
+def resolve_names(candidates) -> dict:
+    """
+    Resolve raw name variants into one canonical name per person.
+
+    Args:
+        candidates (iterable): (name, postal_code) pairs.
+
+    Returns:
+        dict: Canonical name -> list of raw name variants.
+    """
+    blocks = {}
+    count = 0
+    for name, postal_code in candidates:
+        add_name(blocks, name, postal_code)
+        count += 1
+    resolved = {cluster["name"]: cluster["variants"]
+                for clusters in blocks.values() for cluster in clusters}
+    logger.info(f"Resolved {count} names into {len(resolved)} people.")
+    return resolved
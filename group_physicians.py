@@ -10,15 +10,44 @@ from langchain_chroma import Chroma
 from dotenv import load_dotenv
 import os
 import random
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 from logger import setup_logger
+from entity_resolution import add_name, resolve_names
+from immutable import thaw
 import chromadb  # Import chromadb
 
 load_dotenv()
 
 logger = setup_logger('group_physicians_logger', 'group_physicians.log')
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+
+def get_embeddings():
+    """
+    Get the embedding backend selected by the EMBEDDING_BACKEND environment
+    variable: 'huggingface' (default, PyTorch) or 'onnx' (int8 onnxruntime,
+    with ONNX_NUM_THREADS intra-op threads).
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "huggingface").lower()
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        num_threads = int(os.getenv("ONNX_NUM_THREADS", "0")) or None
+        return OnnxEmbeddings(num_threads=num_threads)
+    return HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+
+embeddings = get_embeddings()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+RETRIEVAL_K = 5
+# GROUPING_SHARDS > 1 selects sharded grouping over a process pool.
+GROUPING_SHARDS = int(os.getenv("GROUPING_SHARDS", "1"))
+GROUPING_SHARD_BY = os.getenv("GROUPING_SHARD_BY", "zip")
+# Intra-op threads per grouping worker, so parallel workers do not
+# oversubscribe the CPUs.
+WORKER_THREADS = 1
 vectorstore = None
 
 
@@ -72,46 +101,57 @@ def get_specialty(record: dict) -> str:
     return specialty
 
 
-def process_physician_jsons(json_list):
+def physician_to_document(j: dict) -> Document:
     """
-    Process a list of JSON objects into LangChain Documents.
+    Convert a single physician JSON object into a LangChain Document.
     """
-    documents = []
-    for j in json_list:
-        metadata = {}
-        org, person = get_proper_name(j)
-        metadata["full_name"] = person
-        metadata["organization_name"] = org
-
-        addresses = j.get("addresses", [])
-        location_address = next(
-            (addr for addr in addresses if addr.get("address_purpose") == "LOCATION"), {})
-        city = location_address.get("city", "")
-        state = location_address.get("state", "")
-        address_1 = location_address.get("address_1", "")
-        postal_code = location_address.get("postal_code", "")
-        metadata["address"] = f"{address_1}, {city}, {state} {postal_code}".strip(
-        )
-
-        taxonomies = j.get("taxonomies", [])
-        specialties = [tax.get("desc")
-                       for tax in taxonomies if tax and tax.get("desc")]
-        metadata["specialties"] = ", ".join(specialties)
-        org, person = get_proper_name(j)
-        specialty = get_specialty(j)
-        content = f"{person} is specialized in {specialty} and working in {org}, {j.get('addresses', [{}])[0].get('city', '')}" if org else f"{person} is specialized in {specialty} and located in {j.get('addresses', [{}])[0].get('city', '')}"
-        documents.append(Document(page_content=content, metadata=metadata))
-
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2")
+    metadata = {}
+    org, person = get_proper_name(j)
+    metadata["full_name"] = person
+    metadata["organization_name"] = org
+
+    addresses = j.get("addresses", [])
+    location_address = next(
+        (addr for addr in addresses if addr.get("address_purpose") == "LOCATION"), {})
+    city = location_address.get("city", "")
+    state = location_address.get("state", "")
+    address_1 = location_address.get("address_1", "")
+    postal_code = location_address.get("postal_code", "")
+    metadata["address"] = f"{address_1}, {city}, {state} {postal_code}".strip(
+    )
+
+    taxonomies = j.get("taxonomies", [])
+    specialties = [tax.get("desc")
+                   for tax in taxonomies if tax and tax.get("desc")]
+    metadata["specialties"] = ", ".join(specialties)
+    org, person = get_proper_name(j)
+    specialty = get_specialty(j)
+    content = f"{person} is specialized in {specialty} and working in {org}, {j.get('addresses', [{}])[0].get('city', '')}" if org else f"{person} is specialized in {specialty} and located in {j.get('addresses', [{}])[0].get('city', '')}"
+    return Document(page_content=content, metadata=metadata)
 
+
+def create_vectorstore(documents):
+    """
+    Create a fresh in-memory Chroma vector store from the documents.
+    """
     chroma_api_client.SharedSystemClient.clear_system_cache()
 
     client = chromadb.EphemeralClient()
 
-    vectorstore = Chroma.from_documents(
+    if not documents:
+        return Chroma(collection_name="physicians", embedding_function=embeddings, client=client)
+    return Chroma.from_documents(
         documents, embeddings, collection_name="physicians", client=client)
 
+
+def process_physician_jsons(json_list):
+    """
+    Process a list of JSON objects into LangChain Documents.
+    """
+    documents = [physician_to_document(j) for j in json_list]
+
+    vectorstore = create_vectorstore(documents)
+
     logger.info(
         f"Processed {len(documents)} physician JSON objects into LangChain Documents.")
     print(
@@ -122,13 +162,14 @@ def process_physician_jsons(json_list):
 physician_groups = []
 
 
-def parse_retrievals(docs: list) -> str:
+def parse_retrievals(docs: list, groups: list = physician_groups) -> str:
     """
-    Parse the retrieved documents and return the result.
+    Parse the retrieved documents and return the result. The metadata of the
+    documents is collected into groups.
     """
-    physician_groups.clear()
+    groups.clear()
     result = "\n-----------------\n".join(doc.page_content for doc in docs)
-    physician_groups.extend([doc.metadata for doc in docs])
+    groups.extend([doc.metadata for doc in docs])
     logger.info(f"Parsed {len(docs)} retrieved documents.")
     print(f"Parsed {len(docs)} retrieved documents." +
           random.choice(['+', '/', '*', '-']))
@@ -153,10 +194,12 @@ def retrieve_physician_groups(vectorstore, query_physician_name):
         """)
     ])
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
 
+    # Collect per call so concurrent searches don't share the retrieved groups.
+    retrieved_groups = []
     chain = (
-        {"physician_data": retriever | parse_retrievals,
+        {"physician_data": retriever | (lambda docs: parse_retrievals(docs, retrieved_groups)),
             "input_data": RunnablePassthrough()}
         | prompt_template
         | chat_model
@@ -165,7 +208,30 @@ def retrieve_physician_groups(vectorstore, query_physician_name):
 
     result = chain.invoke(query_physician_name)
     logger.info(f"Retrieved physician groups for {query_physician_name}.")
-    return result, physician_groups
+    return result, retrieved_groups
+
+
+def extract_record_names(record: dict) -> list:
+    """
+    Extract the full names (physician and authorized official) from a record.
+    """
+    names = []
+    basic = record.get("basic", {})
+    first_name = basic.get("first_name", "")
+    middle_name = basic.get("middle_name", "")
+    last_name = basic.get("last_name", "")
+    full_name = f"{first_name} {middle_name} {last_name}".strip()
+    if full_name:
+        names.append(full_name)
+
+    auth_first_name = basic.get("authorized_official_first_name", "")
+    auth_middle_name = basic.get("authorized_official_middle_name", "")
+    auth_last_name = basic.get("authorized_official_last_name", "")
+    auth_full_name = f"{auth_first_name} {auth_middle_name} {auth_last_name}".strip(
+    )
+    if auth_full_name:
+        names.append(auth_full_name)
+    return names
 
 
 def extract_all_names(json_list):
@@ -174,49 +240,281 @@ def extract_all_names(json_list):
     """
     names = set()
     for record in json_list:
-        basic = record.get("basic", {})
-        first_name = basic.get("first_name", "")
-        middle_name = basic.get("middle_name", "")
-        last_name = basic.get("last_name", "")
-        full_name = f"{first_name} {middle_name} {last_name}".strip()
-        if full_name:
-            names.add(full_name)
-
-        auth_first_name = basic.get("authorized_official_first_name", "")
-        auth_middle_name = basic.get("authorized_official_middle_name", "")
-        auth_last_name = basic.get("authorized_official_last_name", "")
-        auth_full_name = f"{auth_first_name} {auth_middle_name} {auth_last_name}".strip(
-        )
-        if auth_full_name:
-            names.add(auth_full_name)
+        names.update(extract_record_names(record))
 
     logger.info(f"Extracted {len(names)} full names from JSON objects.")
     return list(names)
 
 
-def get_groups(physician_data):
+def get_postal_code(record: dict) -> str:
+    """
+    Get the postal code of the record's location address.
+    """
+    addresses = record.get("addresses", [])
+    location_address = next(
+        (addr for addr in addresses if addr.get("address_purpose") == "LOCATION"), {})
+    return location_address.get("postal_code", "")
+
+
+def extract_name_candidates(json_list):
+    """
+    Extract (name, postal code) pairs from a list of JSON objects for
+    entity resolution.
+    """
+    candidates = []
+    for record in json_list:
+        postal_code = get_postal_code(record)
+        candidates.extend((name, postal_code)
+                          for name in extract_record_names(record))
+    return candidates
+
+
+def parse_groups(name, res):
+    """
+    Parse the LLM response for a physician into a list of group names.
+    Returns None if the response cannot be parsed.
+    """
+    try:
+        groups = eval(res)
+        if isinstance(groups, list):
+            return groups
+        return []
+    except (SyntaxError, NameError, TypeError) as e:
+        logger.error(f"Error evaluating result for {name}: {e}")
+        return None
+
+
+def get_groups(physician_data, before_query=None):
     """
     Get the groups that physicians are part of.
+
+    Uses sharded grouping when the GROUPING_SHARDS environment variable is
+    greater than 1 (sharding by GROUPING_SHARD_BY, 'zip' or 'org'), unless
+    before_query is given: throttled background work stays in this process.
+
+    Args:
+        physician_data (list): Physician JSON objects.
+        before_query (callable): Optional function called before each LLM
+                                 query, e.g. to throttle background work.
+    """
+    if GROUPING_SHARDS > 1 and before_query is None:
+        return get_groups_sharded(physician_data, GROUPING_SHARDS, GROUPING_SHARD_BY)
+    return get_groups_local(physician_data, before_query)
+
+
+def get_groups_local(physician_data, before_query=None):
+    """
+    Get the groups that physicians are part of within this process.
     """
     vectorstore = process_physician_jsons(physician_data)
     person_to_groups = {}
     all_physician_groups = []
-    for name in extract_all_names(physician_data):
+    for name in resolve_names(extract_name_candidates(physician_data)):
+        if before_query:
+            before_query()
         res, physician_groups = retrieve_physician_groups(vectorstore, name)
         all_physician_groups.extend(physician_groups)
-        try:
-            groups = eval(res)
-            if isinstance(groups, list):
-                person_to_groups[name] = groups
-            else:
-                person_to_groups[name] = []
-        except (SyntaxError, NameError, TypeError) as e:
-            logger.error(f"Error evaluating result for {name}: {e}")
-            continue
+        groups = parse_groups(name, res)
+        if groups is not None:
+            person_to_groups[name] = groups
     logger.info(f"Retrieved groups for {len(person_to_groups)} physicians.")
     return person_to_groups, all_physician_groups
 
 
+def shard_physicians(physician_data, num_shards, shard_by="zip"):
+    """
+    Partition physicians into shards by ZIP code or organization so that
+    records that are grouped together stay in the same shard.
+
+    Args:
+        physician_data (list): Physician JSON objects.
+        num_shards (int): Number of shards to create.
+        shard_by (str): 'zip' for the 5-digit location ZIP code or 'org' for
+                        the organization (or physician) name.
+
+    Returns:
+        list: Non-empty lists of physician JSON objects.
+    """
+    clusters = {}
+    for record in physician_data:
+        if shard_by == "org":
+            key = get_proper_name(record)[0]
+        else:
+            key = get_postal_code(record)[:5]
+        clusters.setdefault(key, []).append(record)
+
+    # Assign the largest clusters first, each to the currently smallest shard.
+    shards = [[] for _ in range(max(1, num_shards))]
+    for cluster in sorted(clusters.values(), key=len, reverse=True):
+        min(shards, key=len).extend(cluster)
+    return [shard for shard in shards if shard]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    """
+    Warm up the embedding model once in a new worker process, so it is
+    ready for every shard the worker processes.
+    """
+    if isinstance(embeddings, HuggingFaceEmbeddings):
+        import torch
+        torch.set_num_threads(WORKER_THREADS)
+    embeddings.embed_query("physician")
+    logger.info(f"Grouping worker {os.getpid()} ready.")
+
+
+def get_worker_pool(max_workers=None):
+    """
+    Get the long-lived grouping process pool, creating it on first use.
+
+    Workers are spawned rather than forked, since the parent runs threads
+    (search pipeline, cache warmer) whose locks a forked child would inherit.
+
+    Args:
+        max_workers (int): Number of worker processes, defaults to
+                           GROUPING_SHARDS.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers inherit the environment and load the embedding
+            # model on import, so the ONNX backend picks this up there.
+            os.environ.setdefault("ONNX_NUM_THREADS", str(WORKER_THREADS))
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers or max(GROUPING_SHARDS, 1),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker)
+            logger.info("Started grouping process pool.")
+        return _pool
+
+
+def get_groups_sharded(physician_data, num_shards=None, shard_by="zip", max_workers=None):
+    """
+    Get the groups that physicians are part of, grouping shards of the
+    physicians in parallel on the shared worker pool.
+
+    Args:
+        physician_data (list): Physician JSON objects.
+        num_shards (int): Number of shards, defaults to the number of CPUs.
+        shard_by (str): 'zip' or 'org', see shard_physicians.
+        max_workers (int): Size of the worker pool, defaults to num_shards
+                           and is only used when the pool is first created.
+
+    Returns:
+        tuple: (person_to_groups, all_physician_groups) merged over all shards.
+    """
+    global _pool
+    num_shards = num_shards or os.cpu_count() or 1
+    shards = shard_physicians(physician_data, num_shards, shard_by)
+    if len(shards) <= 1:
+        return get_groups_local(physician_data)
+
+    # Cached records are read-only proxies, which cannot be pickled.
+    shards = [thaw(shard) for shard in shards]
+    logger.info(
+        f"Grouping {len(physician_data)} physicians in {len(shards)} shards by {shard_by}.")
+    print(
+        f"Grouping {len(physician_data)} physicians in {len(shards)} shards by {shard_by}.")
+
+    shard_groups = {}
+    all_physician_groups = []
+    executor = get_worker_pool(max_workers or num_shards)
+    try:
+        results = list(executor.map(get_groups_local, shards))
+    except BrokenProcessPool:
+        logger.error("Grouping process pool broke, grouping locally instead.")
+        print("Grouping process pool broke, grouping locally instead.")
+        executor.shutdown(wait=False)
+        with _pool_lock:
+            if _pool is executor:
+                _pool = None
+        return get_groups_local(physician_data)
+    for groups_by_name, shard_physician_groups in results:
+        all_physician_groups.extend(shard_physician_groups)
+        for name, groups in groups_by_name.items():
+            merged = shard_groups.setdefault(name, [])
+            merged.extend(group for group in groups if group not in merged)
+
+    # Variants of a person can end up in different shards (e.g. when
+    # sharding by organization), so resolve names again over all records.
+    person_to_groups = {}
+    for name, variants in resolve_names(extract_name_candidates(physician_data)).items():
+        found = [shard_groups.pop(variant)
+                 for variant in variants if variant in shard_groups]
+        if found:
+            merged = person_to_groups.setdefault(name, [])
+            for groups in found:
+                merged.extend(group for group in groups if group not in merged)
+    person_to_groups.update(shard_groups)
+    logger.info(
+        f"Merged groups for {len(person_to_groups)} physicians from {len(shards)} shards.")
+    return person_to_groups, all_physician_groups
+
+
+def stream_groups(batches):
+    """
+    Get the groups that physicians are part of while records are still
+    arriving. Each batch of records (e.g. one ZIP code's file) is embedded
+    into the vector store as soon as it is received and its names are queried
+    against everything seen so far. Name variants of a person that was
+    already queried are skipped.
+
+    Once all records have arrived, the retriever is run again for the names
+    that were queried against a smaller vector store. The LLM is only asked
+    again when the retrieved records changed, so the final groups are those
+    get_groups would find for the same records.
+
+    Yields:
+        tuple: (name, groups, physician_groups, previous_name) where groups is
+               None if the LLM response could not be parsed and previous_name
+               is the name whose earlier result this one replaces, if any.
+    """
+    vectorstore = create_vectorstore([])
+    blocks = {}
+    queried = []
+    count = 0
+    for batch in batches:
+        batch = list(batch)
+        if not batch:
+            continue
+        vectorstore.add_documents(
+            [physician_to_document(record) for record in batch])
+        count += len(batch)
+        for record in batch:
+            postal_code = get_postal_code(record)
+            for name in extract_record_names(record):
+                cluster, is_new = add_name(blocks, name, postal_code)
+                if not is_new:
+                    continue
+                res, physician_groups = retrieve_physician_groups(
+                    vectorstore, name)
+                groups = parse_groups(name, res)
+                queried.append((cluster, name, count, groups, list(physician_groups)))
+                yield name, groups, list(physician_groups), None
+
+    requeried = 0
+    for cluster, name, seen_count, groups, physician_groups in queried:
+        query_name = cluster["name"]
+        if seen_count == count and query_name == name:
+            continue
+        docs = vectorstore.similarity_search(query_name, k=RETRIEVAL_K)
+        retrieved = [doc.metadata for doc in docs]
+        if retrieved == physician_groups:
+            # Same records, so the LLM would give the same answer.
+            if query_name != name:
+                yield query_name, groups, retrieved, name
+            continue
+        requeried += 1
+        res, physician_groups = retrieve_physician_groups(
+            vectorstore, query_name)
+        yield query_name, parse_groups(query_name, res), list(physician_groups), name
+    logger.info(
+        f"Streamed groups for {len(queried)} physicians from {count} records, re-querying {requeried}.")
+
+
 if __name__ == "__main__":
     physician_data = [
         {
@@ -341,7 +639,7 @@ if __name__ == "__main__":
 
     vectorstore = process_physician_jsons(physician_data)
 
-    for name in extract_all_names(physician_data):
+    for name in resolve_names(extract_name_candidates(physician_data)):
         query_name = name
         print(query_name)
         res, physician_groups = retrieve_physician_groups(
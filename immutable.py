@@ -0,0 +1,27 @@
+from types import MappingProxyType
+
+
+def freeze(value):
+    """
+    Recursively convert dicts and lists into read-only mapping proxies and
+    tuples so that cached data can be shared between sessions without copies.
+    """
+    if isinstance(value, MappingProxyType):
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    Recursively convert frozen data back into plain dicts and lists, e.g.
+    before pickling it for another process.
+    """
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
@@ -4,11 +4,27 @@ import requests
 import json
 from datetime import datetime
 import os
+import glob
 from logger import setup_logger
+from immutable import freeze
+from physician_index import add_to_index, build_physician_index, filter_physicians, load_indexed_physicians
 import streamlit as st
 
 logger = setup_logger('load_logger', 'load.log')
 
+NON_METRO_CODE = 99000  # MSA codes from here on are non-metro areas
+
+
+def is_metro_msa(code):
+    """
+    Check whether an MSA code is a real metropolitan area, i.e. not 0 or a
+    non-metro (99xxx) code.
+    """
+    try:
+        return 0 < int(code) < NON_METRO_CODE
+    except (TypeError, ValueError):
+        return False
+
 
 @st.cache_data
 def fetch_data(msa):
@@ -64,24 +80,37 @@ def fetch_physicians(postal_code):
     return [filename]
 
 
-@st.cache_data
+@st.cache_resource
+def load_physician_file(filename):
+    """
+    Load physician data from a single JSON file, once per process.
+
+    The records are frozen so every session and rerun shares the same
+    read-only objects instead of unpickling its own copy.
+    """
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
+        logger.error(f"Error loading data from {filename}: {e}")
+        print(f"Error loading data from {filename}: {e}")
+        return ()
+    return freeze(data[:5])  # Limit to 5 records for demo
+
+
 def load_physicians(filenames):
     """
     Load physician data from JSON files.
+
+    Returns:
+        tuple: Read-only physician records shared with the per-file cache.
     """
     all_physicians = []
     for filename in filenames:
-        try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-                all_physicians.extend(data[:5])  # Limit to 5 records for demo
-        except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
-            logger.error(f"Error loading data from {filename}: {e}")
-            print(f"Error loading data from {filename}: {e}")
-            continue
+        all_physicians.extend(load_physician_file(filename))
     logger.info(f"Loaded {len(all_physicians)} physicians")
     print(f"Loaded {len(all_physicians)} physicians")
-    return all_physicians
+    return tuple(all_physicians)
 
 
 def get_local_physicians(msa):
@@ -104,17 +133,70 @@ def get_local_physicians(msa):
     return all_physicians
 
 
-@st.cache_data
+def iter_local_physicians(msa, before_fetch=None):
+    """
+    Yield local physicians based on MSA name or code, one batch per ZIP
+    code as its file is loaded, instead of waiting for the whole MSA.
+
+    Args:
+        msa (str): MSA name or code.
+        before_fetch (callable): Called before each ZIP code that is not
+                                 cached yet is fetched from the NPI API.
+    """
+    res = fetch_data(msa)
+    zips = res['ZIP'].tolist()
+    logger.info(f"Streaming physicians for {len(zips)} ZIP codes in {msa}")
+    print(f"Streaming physicians for {len(zips)} ZIP codes in {msa}")
+    for postal_code in zips:
+        postal_code = str(postal_code).zfill(5)
+        if before_fetch and not os.path.exists(f".\\physicians\\{postal_code}.json"):
+            before_fetch()
+        files = fetch_physicians(postal_code)
+        yield load_physicians(files)
+
+
+@st.cache_resource
+def get_physician_index():
+    """
+    Build the taxonomy/specialty inverted index once over the physician store.
+    """
+    filenames = sorted(glob.glob(os.path.join(".\\physicians", "*.json")))
+    return build_physician_index(filenames)
+
+
+def get_filtered_physicians(msa, specialty=None, credential=None, gender=None):
+    """
+    Get local physicians based on MSA name or code, keeping only those that
+    match the specialty, credential and gender filters.
+    """
+    res = fetch_data(msa)
+    zips = res['ZIP'].tolist()
+    index = get_physician_index()
+    # Fetch the ZIP codes that are not cached yet, as an unfiltered search would.
+    filenames = []
+    for postal_code in zips:
+        filenames.extend(fetch_physicians(str(postal_code).zfill(5)))
+    add_to_index(index, filenames)
+    npis = filter_physicians(index, zips=zips, specialty=specialty,
+                             credential=credential, gender=gender)
+    logger.info(f"Found {len(npis)} matching physicians in {msa}")
+    print(f"Found {len(npis)} matching physicians in {msa}")
+    return load_indexed_physicians(index, npis)
+
+
+@st.cache_resource
 def get_all_msa():
     """
     Get all MSA names.
 
     Returns:
         pandas.DataFrame: A DataFrame with one column, 'Addr', containing all MSA names.
+                          The column is backed by an immutable Arrow array and the
+                          DataFrame is shared by all sessions, so it must not be modified.
     """
     conn = sqlite3.connect('.\\Datas\\msatozip.db')
     res = pd.read_sql_query("SELECT DISTINCT(Addr) FROM data_table", conn)
-    return res
+    return res.astype({'Addr': 'string[pyarrow]'})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+import os
+import time
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+from logger import setup_logger
+
+logger = setup_logger('onnx_embeddings_logger', 'onnx_embeddings.log')
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = ".\\models"
+MAX_SEQ_LENGTH = 256
+
+
+def export_onnx_model(model_name=MODEL_NAME, model_dir=MODEL_DIR, quantize=True):
+    """
+    Export the transformer to ONNX and optionally quantize its weights to
+    int8. The exported files are reused on later runs.
+
+    Returns:
+        str: Path of the ONNX model to load.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    base_name = model_name.split("/")[-1]
+    fp32_path = os.path.join(model_dir, f"{base_name}.onnx")
+    int8_path = os.path.join(model_dir, f"{base_name}-int8.onnx")
+    target_path = int8_path if quantize else fp32_path
+    if os.path.exists(target_path):
+        return target_path
+
+    if not os.path.exists(fp32_path):
+        # torch is only needed for the one-off export.
+        import torch
+        from transformers import AutoModel
+
+        logger.info(f"Exporting {model_name} to {fp32_path}")
+        print(f"Exporting {model_name} to {fp32_path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        dummy = tokenizer(["physician"], return_tensors="pt")
+        input_names = ["input_ids", "attention_mask", "token_type_ids"]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"}
+                        for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(dummy[name] for name in input_names), fp32_path,
+                input_names=input_names, output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes, opset_version=14)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"Quantizing {fp32_path} to {int8_path}")
+        print(f"Quantizing {fp32_path} to {int8_path}")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return target_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings for all-MiniLM-L6-v2 computed with onnxruntime on CPU.
+
+    Produces the same mean-pooled, L2-normalized vectors as the
+    sentence-transformers model so it can replace HuggingFaceEmbeddings.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, model_dir=MODEL_DIR, quantize=True,
+                 num_threads=None, batch_size=32):
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model_path = export_onnx_model(model_name, model_dir, quantize)
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        logger.info(
+            f"Loaded ONNX embeddings from {model_path} with {num_threads or 'default'} threads.")
+
+    def _encode(self, texts):
+        """
+        Encode texts in batches into normalized sentence embeddings.
+        """
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            encoded = self.tokenizer(batch, padding=True, truncation=True,
+                                     max_length=MAX_SEQ_LENGTH, return_tensors="np")
+            feeds = {name: encoded[name].astype(np.int64)
+                     for name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / \
+                np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1,
+                              keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts))
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+
+if __name__ == "__main__":
+    # Parity check and docs/sec benchmark against the PyTorch backend.
+    import glob
+    import json
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from group_physicians import physician_to_document
+
+    texts = []
+    for filename in sorted(glob.glob(os.path.join(".\\physicians", "*.json")))[:50]:
+        with open(filename, 'r') as f:
+            texts.extend(physician_to_document(j).page_content
+                         for j in json.load(f))
+    print(f"Benchmarking on {len(texts)} documents")
+
+    torch_embeddings = HuggingFaceEmbeddings(model_name=MODEL_NAME)
+    onnx_embeddings = OnnxEmbeddings(
+        num_threads=int(os.getenv("ONNX_NUM_THREADS", "0")) or None)
+
+    def benchmark(backend, runs=5):
+        """
+        Embed the texts once to warm the backend up, then time a few runs and
+        return the embeddings and the median docs/sec.
+        """
+        backend.embed_documents(texts[:32])
+        rates = []
+        for _ in range(runs):
+            tt = time.time()
+            result = backend.embed_documents(texts)
+            rates.append(len(texts) / (time.time() - tt))
+        return np.array(result), float(np.median(rates))
+
+    expected, torch_rate = benchmark(torch_embeddings)
+    actual, onnx_rate = benchmark(onnx_embeddings)
+
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    similarity = (expected * actual).sum(axis=1)
+    print(f"Cosine similarity: min={similarity.min():.4f} mean={similarity.mean():.4f}")
+    print(f"PyTorch: {torch_rate:.1f} docs/sec (median of 5 runs)")
+    print(f"ONNX int8: {onnx_rate:.1f} docs/sec (median of 5 runs)")
+    assert similarity.min() > 0.98, "ONNX embeddings diverge from PyTorch"
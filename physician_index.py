@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from logger import setup_logger
+
+logger = setup_logger('physician_index_logger', 'physician_index.log')
+
+INDEX_FIELDS = ("code", "desc", "primary_code", "primary_desc", "primary",
+                "state", "credential", "gender", "zip")
+
+# The index is shared by all sessions and grows as new ZIP codes are fetched.
+_index_lock = threading.Lock()
+
+
+def normalize_credential(credential) -> str:
+    """
+    Normalize a credential so that variants like 'M.D.' and 'MD' match.
+    """
+    if not credential:
+        return ""
+    return "".join(ch for ch in str(credential).upper() if ch.isalnum())
+
+
+def index_record(index: dict, record: dict, filename: str):
+    """
+    Add a single physician record to the inverted index.
+    """
+    npi = record.get("number")
+    if not npi:
+        return
+    npi = str(npi)
+    index["locations"].setdefault(npi, filename)
+
+    postal_code = os.path.splitext(os.path.basename(filename))[0]
+    index["zip"][postal_code].add(npi)
+
+    basic = record.get("basic", {})
+    credential = normalize_credential(basic.get("credential"))
+    if credential:
+        index["credential"][credential].add(npi)
+    gender = basic.get("gender")
+    if gender:
+        index["gender"][gender.upper()].add(npi)
+
+    for tax in record.get("taxonomies", []):
+        if not tax:
+            continue
+        if tax.get("code"):
+            index["code"][tax["code"].upper()].add(npi)
+        if tax.get("desc"):
+            index["desc"][tax["desc"].upper()].add(npi)
+        if tax.get("state"):
+            index["state"][tax["state"].upper()].add(npi)
+        if tax.get("primary"):
+            index["primary"][True].add(npi)
+            if tax.get("code"):
+                index["primary_code"][tax["code"].upper()].add(npi)
+            if tax.get("desc"):
+                index["primary_desc"][tax["desc"].upper()].add(npi)
+
+
+def add_to_index(index, filenames):
+    """
+    Index the physician files that are not part of the index yet.
+    """
+    with _index_lock:
+        new_files = [f for f in filenames if f not in index["files"]]
+        for filename in new_files:
+            try:
+                with open(filename, 'r') as f:
+                    data = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
+                logger.error(f"Error indexing {filename}: {e}")
+                continue
+            index["files"].add(filename)
+            for record in data:
+                index_record(index, record, filename)
+    if new_files:
+        logger.info(f"Indexed {len(new_files)} new files.")
+    return new_files
+
+
+def build_physician_index(filenames):
+    """
+    Build an inverted index from taxonomy code/desc, primary flag, state,
+    credential, gender and ZIP code to NPI numbers.
+
+    Args:
+        filenames (list): Cached physician JSON files to index.
+
+    Returns:
+        dict: One mapping of value -> set of NPI numbers per field in
+              INDEX_FIELDS, plus 'locations' mapping NPI -> source file and
+              'files' holding the indexed files.
+    """
+    index = {field: defaultdict(set) for field in INDEX_FIELDS}
+    index["locations"] = {}
+    index["files"] = set()
+    add_to_index(index, filenames)
+    logger.info(
+        f"Indexed {len(index['locations'])} physicians from {len(filenames)} files.")
+    print(
+        f"Indexed {len(index['locations'])} physicians from {len(filenames)} files.")
+    return index
+
+
+def get_specialties(index) -> list:
+    """
+    Get all taxonomy descriptions known to the index.
+    """
+    with _index_lock:
+        return sorted(index["desc"].keys())
+
+
+def match_specialty(index, specialty, partial=False, primary=False) -> set:
+    """
+    Get the NPI numbers whose taxonomy code or description equals the given
+    specialty.
+
+    Args:
+        index (dict): Index built by build_physician_index.
+        specialty (str): Taxonomy code or description.
+        partial (bool): Also match descriptions that contain the specialty,
+                        e.g. 'SURGERY' matches 'Dentist, Oral and
+                        Maxillofacial Surgery'.
+        primary (bool): Only match taxonomies flagged as primary.
+    """
+    code_field, desc_field = ("primary_code", "primary_desc") if primary else (
+        "code", "desc")
+    specialty = specialty.strip().upper()
+    matches = set(index[code_field].get(specialty, set()))
+    matches |= index[desc_field].get(specialty, set())
+    if partial:
+        for desc, npis in index[desc_field].items():
+            if specialty in desc:
+                matches |= npis
+    return matches
+
+
+def filter_physicians(index, zips=None, specialty=None, credential=None,
+                      gender=None, state=None, primary_only=False,
+                      partial_specialty=False) -> set:
+    """
+    Filter physicians by intersecting the posting sets of every given filter.
+
+    Args:
+        index (dict): Index built by build_physician_index.
+        zips (list): ZIP codes to restrict the search to, e.g. those of an MSA.
+        specialty (str): Taxonomy code or description.
+        credential (str): Credential such as 'MD' or 'M.D.'.
+        gender (str): 'M' or 'F'.
+        state (str): Taxonomy license state.
+        primary_only (bool): Only keep physicians whose primary taxonomy is
+                             the specialty, or who have a primary taxonomy
+                             if no specialty is given.
+        partial_specialty (bool): Match descriptions containing the
+                                  specialty instead of only exact ones.
+
+    Returns:
+        set: The matching NPI numbers.
+    """
+    with _index_lock:
+        return _filter_physicians(index, zips, specialty, credential,
+                                  gender, state, primary_only,
+                                  partial_specialty)
+
+
+def _filter_physicians(index, zips, specialty, credential, gender, state,
+                       primary_only, partial_specialty) -> set:
+    candidates = []
+    if zips is not None:
+        candidates.append(set().union(
+            *(index["zip"].get(str(z).zfill(5), set()) for z in zips)))
+    if specialty:
+        candidates.append(match_specialty(
+            index, specialty, partial=partial_specialty, primary=primary_only))
+    if credential:
+        candidates.append(index["credential"].get(
+            normalize_credential(credential), set()))
+    if gender:
+        candidates.append(index["gender"].get(gender.upper(), set()))
+    if state:
+        candidates.append(index["state"].get(state.upper(), set()))
+    if primary_only and not specialty:
+        candidates.append(index["primary"].get(True, set()))
+
+    if not candidates:
+        return set(index["locations"])
+    # Intersect the smallest sets first so the work stays proportional to
+    # the most selective filter.
+    candidates.sort(key=len)
+    result = set(candidates[0])
+    for npis in candidates[1:]:
+        result &= npis
+        if not result:
+            break
+    logger.info(f"Filter matched {len(result)} physicians.")
+    return result
+
+
+def load_indexed_physicians(index, npis) -> list:
+    """
+    Load only the records for the given NPI numbers from their source files.
+    """
+    by_file = defaultdict(set)
+    for npi in npis:
+        filename = index["locations"].get(npi)
+        if filename:
+            by_file[filename].add(npi)
+
+    physicians = []
+    for filename, wanted in sorted(by_file.items()):
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
+            logger.error(f"Error loading data from {filename}: {e}")
+            continue
+        for record in data:
+            npi = str(record.get("number"))
+            if npi in wanted:
+                physicians.append(record)
+                wanted.discard(npi)
+    logger.info(f"Loaded {len(physicians)} filtered physicians")
+    print(f"Loaded {len(physicians)} filtered physicians")
+    return physicians
@@ -0,0 +1,181 @@
+import itertools
+import queue
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from group_physicians import stream_groups
+from plot_physician_groups import extract_record
+from logger import setup_logger
+
+logger = setup_logger('pipeline_logger', 'pipeline.log')
+
+QUEUE_SIZE = 8
+_DONE = object()
+
+
+def _put(q, item, stop):
+    """
+    Put an item on a bounded queue, giving up once the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_queue(q, stop):
+    """
+    Yield items from a queue until the end marker arrives or the pipeline is
+    stopped.
+    """
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def row_key(metadata):
+    """
+    Get the key identifying the map row of a retrieved physician group, as
+    (address, name). Matches (row['Address'], row['Name/Group']).
+    """
+    return (metadata.get("address"), metadata.get("organization_name") or metadata.get("full_name"))
+
+
+def _load_stage(source, record_q, stop, record_limit):
+    """
+    Stream batches of physician records from the source into the grouping
+    stage, stopping once record_limit records have been sent.
+    """
+    remaining = record_limit
+    try:
+        for batch in source:
+            batch = tuple(itertools.islice(batch, remaining))
+            if batch and not _put(record_q, batch, stop):
+                return
+            remaining -= len(batch)
+            if remaining <= 0:
+                break
+    except Exception as e:
+        logger.error(f"Error loading physicians: {e}")
+        print(f"Error loading physicians: {e}")
+    finally:
+        _put(record_q, _DONE, stop)
+
+
+def _group_stage(record_q, geo_q, out_q, stop):
+    """
+    Group physicians as records arrive and forward the retrieved physician
+    groups to the geocoding stage. When a result replaces an earlier one,
+    the map rows only the earlier retrieval contributed are retracted.
+    """
+    contributions = {}
+    references = {}
+    try:
+        for name, groups, physician_groups, previous_name in stream_groups(_iter_queue(record_q, stop)):
+            if groups is not None:
+                _put(out_q, ("group", name, groups, previous_name), stop)
+            keys = {row_key(metadata) for metadata in physician_groups}
+            for key in keys:
+                references[key] = references.get(key, 0) + 1
+            for metadata in physician_groups:
+                _put(geo_q, ("metadata", metadata), stop)
+            if previous_name is not None:
+                for key in contributions.pop(previous_name, set()):
+                    references[key] -= 1
+                    if not references[key]:
+                        _put(geo_q, ("retract", key), stop)
+            contributions[name] = keys
+    except Exception as e:
+        logger.error(f"Error grouping physicians: {e}")
+        print(f"Error grouping physicians: {e}")
+    finally:
+        _put(geo_q, _DONE, stop)
+        _put(out_q, _DONE, stop)
+
+
+def _geocode_stage(geo_q, out_q, stop, row_limit):
+    """
+    Geocode each physician group as soon as it has been retrieved, and pass
+    on retractions of rows that were geocoded.
+    """
+    seen = set()
+    try:
+        for kind, item in _iter_queue(geo_q, stop):
+            if kind == "retract":
+                if item in seen:
+                    seen.discard(item)
+                    _put(out_q, ("retract", item), stop)
+                continue
+            # Keep draining after the limit so the grouping stage never blocks.
+            if len(seen) >= row_limit:
+                continue
+            key = row_key(item)
+            if key in seen:
+                continue
+            seen.add(key)
+            row = extract_record(item)
+            if row:
+                _put(out_q, ("row", row), stop)
+    except Exception as e:
+        logger.error(f"Error geocoding physicians: {e}")
+        print(f"Error geocoding physicians: {e}")
+    finally:
+        _put(out_q, _DONE, stop)
+
+
+def run_search_pipeline(source, record_limit=20, row_limit=20, queue_size=QUEUE_SIZE):
+    """
+    Run loading, grouping and geocoding concurrently as a producer/consumer
+    pipeline connected by bounded queues.
+
+    Args:
+        source (iterable): Batches of physician JSON records, e.g. from
+                           iter_local_physicians.
+        record_limit (int): Maximum number of records to group.
+        row_limit (int): Maximum number of distinct groups to geocode.
+        queue_size (int): Capacity of each queue between stages.
+
+    Yields:
+        tuple: ("group", name, groups, previous_name) when a physician's groups
+               are known, replacing the result for previous_name if given,
+               ("row", row) when a group has been geocoded, or
+               ("retract", key) when the row with that row_key is no longer
+               part of the results.
+    """
+    record_q = queue.Queue(maxsize=queue_size)
+    geo_q = queue.Queue(maxsize=queue_size)
+    out_q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    ctx = get_script_run_ctx()
+    threads = [
+        threading.Thread(target=_load_stage, args=(
+            source, record_q, stop, record_limit), daemon=True),
+        threading.Thread(target=_group_stage, args=(
+            record_q, geo_q, out_q, stop), daemon=True),
+        threading.Thread(target=_geocode_stage, args=(
+            geo_q, out_q, stop, row_limit), daemon=True),
+    ]
+    for thread in threads:
+        add_script_run_ctx(thread, ctx)
+        thread.start()
+
+    # The grouping and geocoding stages each send one end marker.
+    pending = 2
+    try:
+        while pending:
+            item = out_q.get()
+            if item is _DONE:
+                pending -= 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        logger.info("Search pipeline finished.")
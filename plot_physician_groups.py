@@ -50,6 +50,42 @@ def geocode_address(address, max_retries=3, initial_delay=1, provider='nominatim
     return None
 
 
+def extract_record(record):
+    """
+    Geocodes a single physician/group dictionary into a map row.
+
+    Args:
+        record (dict): Dictionary with keys like 'address', 'full_name',
+                       'organization_name', and 'specialties'.
+
+    Returns:
+        dict: The row for the map DataFrame, or None if the record has no
+              address or could not be geocoded.
+    """
+    address = record.get('address')
+    full_name = record.get('full_name')
+    organization_name = record.get('organization_name')
+    specialties = record.get('specialties')
+    name = organization_name if organization_name else full_name
+
+    if not address:
+        print("Missing address. Skipping record.")
+        return None
+
+    coordinates = geocode_address(address, provider='arcgis')
+    if not coordinates:
+        print(f"Geocoding failed for {address}. Skipping record.")
+        return None
+
+    return {
+        "Name/Group": name,
+        "Specialty": specialties,
+        "Address": address,
+        "Latitude": coordinates[1],
+        "Longitude": coordinates[0]
+    }
+
+
 def extract_data_from_list(data_list):
     """
     Extracts data from a list of dictionaries, geocodes addresses, and
@@ -71,28 +107,9 @@ returns a Pandas DataFrame.
         return pd.DataFrame(records)
 
     for record in data_list:
-        address = record.get('address')
-        full_name = record.get('full_name')
-        organization_name = record.get('organization_name')
-        specialties = record.get('specialties')
-        name = organization_name if organization_name else full_name
-
-        if not address:
-            print("Missing address. Skipping record.")
-            continue
-
-        coordinates = geocode_address(address, provider='arcgis')
-        if not coordinates:
-            print(f"Geocoding failed for {address}. Skipping record.")
-            continue
-
-        records.append({
-            "Name/Group": name,
-            "Specialty": specialties,
-            "Address": address,
-            "Latitude": coordinates[1],
-            "Longitude": coordinates[0]
-        })
+        row = extract_record(record)
+        if row:
+            records.append(row)
 
     if not records:
         print("No records could be geocoded.")
@@ -117,13 +134,18 @@ def create_map(df):
 
     center_lat = df["Latitude"].mean()
     center_lon = df["Longitude"].mean()
+    hover_data = {"Specialty": True, "Address": True}
+    if "CBSA Name" in df.columns:
+        hover_data["CBSA Name"] = True
+    if "In MSA" in df.columns:
+        hover_data["In MSA"] = True
 
     fig = px.scatter_mapbox(
         df,
         lat="Latitude",
         lon="Longitude",
         hover_name="Name/Group",
-        hover_data={"Specialty": True, "Address": True},
+        hover_data=hover_data,
         color_discrete_sequence=["green"],
         zoom=10,
         height=600,
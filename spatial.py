@@ -0,0 +1,139 @@
+import os
+from functools import lru_cache
+import numpy as np
+import geopandas as gpd
+import shapely
+from logger import setup_logger
+from load import is_metro_msa
+
+logger = setup_logger('spatial_logger', 'spatial.log')
+
+CBSA_SHAPE_PATH = '.\\Datas\\shape\\cb_2013_us_cbsa_500k.shp'
+
+
+@lru_cache(maxsize=1)
+def load_cbsa_index(path=CBSA_SHAPE_PATH):
+    """
+    Load the CBSA shapes and build an STRtree over them once per process.
+
+    Returns:
+        tuple: (STRtree, CBSA codes, CBSA names) or None if the shapefile
+               cannot be read.
+    """
+    if not os.path.exists(path):
+        logger.error(f"CBSA shapefile not found: {path}")
+        print(f"CBSA shapefile not found: {path}")
+        return None
+    try:
+        cbsa = gpd.read_file(path).to_crs(epsg=4326)
+    except Exception as e:
+        logger.error(f"Error loading CBSA shapes from {path}: {e}")
+        print(f"Error loading CBSA shapes from {path}: {e}")
+        return None
+    tree = shapely.STRtree(cbsa.geometry.values)
+    logger.info(f"Built CBSA index over {len(cbsa)} shapes.")
+    return tree, cbsa["CBSAFP"].to_numpy(dtype=object), cbsa["NAME"].to_numpy(dtype=object)
+
+
+def locate_points(longitudes, latitudes):
+    """
+    Find the CBSA that each point falls in with a single vectorized query.
+
+    Args:
+        longitudes (array-like): Point longitudes.
+        latitudes (array-like): Point latitudes.
+
+    Returns:
+        tuple: (codes, names) arrays aligned with the input, holding None for
+               points outside every CBSA, or None if the index is unavailable.
+    """
+    index = load_cbsa_index()
+    if index is None:
+        return None
+    tree, cbsa_codes, cbsa_names = index
+    points = shapely.points(np.asarray(longitudes, dtype=float),
+                            np.asarray(latitudes, dtype=float))
+    codes = np.full(len(points), None, dtype=object)
+    names = np.full(len(points), None, dtype=object)
+    point_idx, shape_idx = tree.query(points, predicate="within")
+    codes[point_idx] = cbsa_codes[shape_idx]
+    names[point_idx] = cbsa_names[shape_idx]
+    return codes, names
+
+
+def find_msa(longitude, latitude):
+    """
+    Find the MSA that a point is in.
+
+    Returns:
+        tuple: (CBSA code, CBSA name), or None if the point is outside every
+               CBSA or the index is unavailable.
+    """
+    located = locate_points([longitude], [latitude])
+    if located is None or located[0][0] is None:
+        return None
+    return located[0][0], located[1][0]
+
+
+def checkable_msa_codes(msa_codes):
+    """
+    Get the searched MSA codes that can be checked against the CBSA shapes.
+
+    msatozip.db does not follow the 2013 CBSA definitions: non-metro (99xxx)
+    and 0 codes have no shape, and some older MSA codes no longer exist.
+    If any searched code is one of those, no code is returned, so rows in
+    the unchecked area are never flagged.
+    """
+    index = load_cbsa_index()
+    if index is None or not msa_codes:
+        return set()
+    known = set(index[1])
+    codes = set()
+    for code in msa_codes:
+        if not is_metro_msa(code):
+            return set()
+        code = str(int(code)).zfill(5)
+        if code not in known:
+            return set()
+        codes.add(code)
+    return codes
+
+
+def label_cbsa(df, msa_codes=None, drop_outliers=False):
+    """
+    Label geocoded rows with the CBSA they actually fall in and flag the rows
+    that land outside the searched MSA.
+
+    Args:
+        df (pd.DataFrame): DataFrame with Latitude and Longitude columns.
+        msa_codes (list): Codes of the searched MSA(s). Rows are only flagged
+                          for codes that exist in the CBSA shapes, see
+                          checkable_msa_codes.
+        drop_outliers (bool): Drop flagged rows instead of only flagging them.
+
+    Returns:
+        pd.DataFrame: A copy of the DataFrame with 'CBSA', 'CBSA Name' and
+                      'In MSA' columns added, or the DataFrame unchanged if
+                      the CBSA shapes are unavailable.
+    """
+    if df.empty:
+        return df
+    located = locate_points(df["Longitude"], df["Latitude"])
+    if located is None:
+        return df
+
+    df = df.copy()
+    df["CBSA"], df["CBSA Name"] = located
+    wanted = checkable_msa_codes(msa_codes)
+    if wanted:
+        df["In MSA"] = df["CBSA"].isin(wanted)
+    else:
+        df["In MSA"] = True
+
+    outliers = int((~df["In MSA"]).sum())
+    if outliers:
+        logger.warning(f"{outliers} geocoded rows fall outside {msa_codes}.")
+        print(f"{outliers} geocoded rows fall outside {msa_codes}.")
+    if drop_outliers:
+        df = df[df["In MSA"]]
+    return df
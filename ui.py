@@ -1,7 +1,12 @@
 import pandas as pd
-from group_physicians import get_groups
+from group_physicians import get_groups, GROUPING_SHARDS
 from plot_physician_groups import geocode_address, extract_data_from_list, create_map
-from load import get_local_physicians, get_all_msa
+from spatial import label_cbsa
+from load import fetch_data, get_local_physicians, get_filtered_physicians, iter_local_physicians, get_all_msa, get_physician_index
+from pipeline import run_search_pipeline
+from cache_warmer import start_cache_warmer, record_search, get_warm_results, live_search
+from immutable import freeze
+from physician_index import get_specialties
 import streamlit.components.v1 as components
 import streamlit as st
 from logger import setup_logger
@@ -10,20 +15,39 @@ import time
 logger = setup_logger('ui_logger', 'ui.log')
 
 
-@st.cache_data
-def search_physicians(msa_name, msa_code, input_type):
+@st.cache_resource
+def search_physicians(msa_name, msa_code, input_type, specialty=None, credential=None, gender=None):
     """
-    Search for physicians based on MSA Name or MSA Code.
+    Search for physicians based on MSA Name or MSA Code, optionally filtered
+    by specialty, credential and gender.
+
+    Returns:
+        tuple: Read-only physician records shared by every session.
     """
     logger.info(
         f"Searching physicians with {input_type}: {msa_name if input_type == 'MSA Name' else msa_code}")
     print(
         f"Searching physicians with {input_type}: {msa_name if input_type == 'MSA Name' else msa_code}")
     if input_type == "MSA Name":
-        return get_local_physicians(msa_name)
+        msa = msa_name
     elif input_type == "MSA Code":
-        return get_local_physicians(msa_code)
-    return None
+        msa = msa_code
+    else:
+        return None
+    if specialty or credential or gender:
+        return freeze(get_filtered_physicians(msa, specialty=specialty, credential=credential, gender=gender))
+    return get_local_physicians(msa)
+
+
+def stream_physicians(msa_name, msa_code, input_type, specialty=None, credential=None, gender=None):
+    """
+    Stream batches of physicians based on MSA Name or MSA Code so that
+    grouping can start before every ZIP code has been loaded.
+    """
+    msa = msa_name if input_type == "MSA Name" else msa_code
+    if specialty or credential or gender:
+        return iter([search_physicians(msa_name, msa_code, input_type, specialty, credential, gender)])
+    return iter_local_physicians(msa)
 
 
 @st.cache_data
@@ -55,11 +79,69 @@ def display_person_groups(person_groups):
     st.dataframe(person_groups_df, use_container_width=True)
 
 
+def stream_search(msa_name, msa_code, input_type, specialty, credential, gender, msa_codes, tt):
+    """
+    Run the search pipeline and update the map and person groups as results
+    arrive. Returns the geocoded rows.
+    """
+    source = stream_physicians(
+        msa_name, msa_code, input_type, specialty or None, credential or None, gender or None)
+    map_placeholder = st.empty()
+    groups_placeholder = st.empty()
+    person_groups = {}
+    rows = []
+    first_result = None
+    with live_search():
+        for item in run_search_pipeline(source):
+            if first_result is None:
+                first_result = time.time() - tt
+                print("== Time to first result: ", first_result)
+            if item[0] == "group":
+                _, name, groups, previous_name = item
+                person_groups.pop(previous_name, None)
+                person_groups[name] = groups
+                with groups_placeholder.container():
+                    display_person_groups(person_groups)
+            else:
+                if item[0] == "retract":
+                    rows = [row for row in rows
+                            if (row["Address"], row["Name/Group"]) != item[1]]
+                else:
+                    rows.append(item[1])
+                data = label_cbsa(pd.DataFrame(rows), msa_codes)
+                physician_map = create_map(data)
+                if physician_map:
+                    with map_placeholder.container():
+                        display_map(physician_map)
+                else:
+                    map_placeholder.empty()
+    return rows
+
+
+def batch_search(msa_name, msa_code, input_type, specialty, credential, gender, msa_codes):
+    """
+    Group every loaded physician at once with sharded grouping, for large
+    MSAs. Returns the geocoded rows.
+    """
+    json_data = search_physicians(
+        msa_name, msa_code, input_type, specialty or None, credential or None, gender or None)
+    with live_search():
+        person_groups, data_lst = get_groups(json_data)
+        data = extract_data_from_list(data_lst[:20])
+    if not data.empty:
+        physician_map = create_map(label_cbsa(data, msa_codes))
+        if physician_map:
+            display_map(physician_map)
+    display_person_groups(person_groups)
+    return data.to_dict('records')
+
+
 def main():
     """
     Main function to run the Streamlit app.
     """
     st.title("Physician Locator")
+    start_cache_warmer()
     input_type = st.radio("## Search by:", ("MSA Name", "MSA Code"))
     msa_names_df = get_all_msa()
     msa_names = msa_names_df['Addr'].tolist()
@@ -68,21 +150,50 @@ def main():
     msa_code = st.text_input(
         "Enter MSA Code:") if input_type == "MSA Code" else None
 
+    with st.expander("Filters"):
+        specialty = st.selectbox(
+            "Specialty:", options=[""] + get_specialties(get_physician_index()))
+        credential = st.text_input("Credential (e.g. MD):")
+        gender = st.selectbox("Gender:", options=["", "F", "M"])
+
     if st.button("Search"):
         tt = time.time()
-        json_data = search_physicians(msa_name, msa_code, input_type)
-        person_groups, data_lst = get_groups(json_data[:20])
-        data = extract_data_from_list(data_lst[:20])
-        if data is not None and not data.empty:
-            physician_map = create_map(data)
-            if physician_map:
-                display_map(physician_map)
-                display_person_groups(person_groups)
-            else:
-                logger.error("Failed to create map.")
-                print("Failed to create map.")
-                st.error("Failed to create map.")
+        msa = msa_name if input_type == "MSA Name" else msa_code
+        if not msa or not str(msa).strip():
+            st.warning("Please enter an MSA.")
+            return
+        res = fetch_data(msa)
+        if res.empty:
+            logger.warning(f"No ZIP codes found for {msa}.")
+            print(f"No ZIP codes found for {msa}.")
+            st.warning(f"No ZIP codes found for {msa}.")
+            return
+        msa_codes = res['MSA'].unique().tolist()
+        # Count and look up searches by MSA code, so name and code searches
+        # for the same MSA share statistics and warm results.
+        warm = None
+        if len(msa_codes) == 1:
+            record_search(msa_codes[0])
+            # The warmer groups records locally, so its results would differ
+            # from a sharded search.
+            if not (specialty or credential or gender) and GROUPING_SHARDS <= 1:
+                warm = get_warm_results(msa_codes[0])
+        if warm is not None:
+            print("== Cache warm for ", msa)
+            person_groups, data = warm
+            rows = data.to_dict('records')
+            if rows:
+                physician_map = create_map(label_cbsa(data, msa_codes))
+                if physician_map:
+                    display_map(physician_map)
+            display_person_groups(person_groups)
+        elif GROUPING_SHARDS > 1:
+            rows = batch_search(msa_name, msa_code, input_type, specialty,
+                                credential, gender, msa_codes)
         else:
+            rows = stream_search(msa_name, msa_code, input_type, specialty,
+                                 credential, gender, msa_codes, tt)
+        if not rows:
             logger.warning("No physician data to plot.")
             print("No physician data to plot.")
             st.warning("No physician data to plot.")